@@ -5,16 +5,11 @@ Routes requests to appropriate endpoints
 
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-import sys
-import os
 
-# Add backend directory to Python path
-backend_dir = os.path.join(os.path.dirname(__file__), '..', 'backend')
-sys.path.insert(0, backend_dir)
-
-# Import handlers
+# Only the lightweight health handler is imported eagerly; the analyze
+# handler (which pulls in cv2 + TensorFlow) is imported lazily inside
+# its route so health checks never pay the heavy import cost
 from health import health as health_handler
-from analyze import analyze as analyze_handler
 
 app = Flask(__name__)
 CORS(app, origins="*")  # Allow all origins, configure for production
@@ -34,6 +29,7 @@ def analyze():
         response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
         response.headers.add('Access-Control-Allow-Methods', 'POST')
         return response
+    from analyze import analyze as analyze_handler
     return analyze_handler()
 
 # For local testing
@@ -0,0 +1,6 @@
+"""
+Plantalyze backend package - preprocessing, segmentation and classification
+
+Kept free of imports so importing the package never pulls in the heavy
+cv2/TensorFlow/PyTorch dependencies of the submodules.
+"""
@@ -0,0 +1,82 @@
+"""
+Micro-batching wrapper for UNet inference
+Groups concurrent segmentation requests into a single model.predict call
+"""
+
+import queue
+import threading
+import time
+
+import numpy as np
+
+# How long to wait for more requests to join a batch, and the batch cap.
+# 20 ms is small next to per-image inference time, so the added latency is
+# negligible compared to the throughput gain under concurrent load.
+BATCH_WAIT_SECONDS = 0.02
+MAX_BATCH_SIZE = 8
+
+
+class SegmentationBatcher:
+    """
+    Drop-in wrapper around a loaded UNet model whose predict() routes
+    images through a shared queue so concurrent requests are batched
+    into one inference call.
+
+    Safe with gunicorn gthread workers: all request threads submit into
+    the same queue and a single background thread owns the model.
+    """
+
+    def __init__(self, model, max_batch_size=MAX_BATCH_SIZE, batch_wait=BATCH_WAIT_SECONDS):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.batch_wait = batch_wait
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(
+            target=self._run, name="segmentation-batcher", daemon=True
+        )
+        self._worker.start()
+
+    def predict(self, batch, verbose=0):
+        """Keras-style predict(); blocks until the batched inference completes"""
+        items = []
+        for image in np.asarray(batch):
+            item = {'image': image, 'done': threading.Event(), 'result': None, 'error': None}
+            self._queue.put(item)
+            items.append(item)
+
+        outputs = []
+        for item in items:
+            item['done'].wait()
+            if item['error'] is not None:
+                raise item['error']
+            outputs.append(item['result'])
+
+        return np.stack(outputs)
+
+    def _run(self):
+        while True:
+            # Block for the first item, then give other threads a short
+            # window to join the batch
+            batch_items = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_wait
+
+            while len(batch_items) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch_items.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                batch = np.stack([item['image'] for item in batch_items])
+                predictions = self.model.predict(batch, verbose=0)
+                for item, prediction in zip(batch_items, predictions):
+                    item['result'] = prediction
+            except Exception as e:
+                for item in batch_items:
+                    item['error'] = e
+            finally:
+                for item in batch_items:
+                    item['done'].set()
@@ -4,12 +4,18 @@ Loads ShuffleNet model with 4-channel input (RGB + Mask) for disease classificat
 """
 
 import os
+import cv2
 import torch
 import torch.nn as nn
 from torchvision import models, transforms
 from PIL import Image
 import numpy as np
 
+# ImageNet normalization for the RGB channels; the mask channel passes through.
+# Allocated once at module scope and applied as a single broadcast op.
+_NORM_MEAN = torch.tensor([0.485, 0.456, 0.406, 0.0]).view(1, 4, 1, 1)
+_NORM_STD = torch.tensor([0.229, 0.224, 0.225, 1.0]).view(1, 4, 1, 1)
+
 
 def load_shufflenet_model(checkpoint_path, num_classes=26):
     """
@@ -65,22 +71,30 @@ def load_shufflenet_model(checkpoint_path, num_classes=26):
             return None, device
         
         print(f"Loading checkpoint from {checkpoint_path}...")
-        checkpoint = torch.load(checkpoint_path, map_location=device)
-        
-        # Extract state dict
-        if 'state_dict' in checkpoint:
-            state_dict = checkpoint['state_dict']
-        elif 'model_state_dict' in checkpoint:
-            state_dict = checkpoint['model_state_dict']
+        if str(checkpoint_path).endswith('.safetensors'):
+            # mmap-backed zero-copy tensor load; 'module.' prefixes were
+            # already stripped at conversion time
+            from safetensors.torch import load_file
+            new_state_dict = load_file(checkpoint_path, device=str(device))
         else:
-            state_dict = checkpoint
-        
-        # Remove 'module.' prefix if present (from DataParallel)
-        new_state_dict = {}
-        for k, v in state_dict.items():
-            new_key = k.replace("module.", "")
-            new_state_dict[new_key] = v
-        
+            # weights_only skips pickle's arbitrary-object path, which is
+            # both faster and avoids executing pickled code
+            checkpoint = torch.load(checkpoint_path, map_location=device, weights_only=True)
+
+            # Extract state dict
+            if 'state_dict' in checkpoint:
+                state_dict = checkpoint['state_dict']
+            elif 'model_state_dict' in checkpoint:
+                state_dict = checkpoint['model_state_dict']
+            else:
+                state_dict = checkpoint
+
+            # Remove 'module.' prefix if present (from DataParallel)
+            new_state_dict = {}
+            for k, v in state_dict.items():
+                new_key = k.replace("module.", "")
+                new_state_dict[new_key] = v
+
         # Load weights (strict=False to allow minor mismatches)
         missing_keys, unexpected_keys = model.load_state_dict(new_state_dict, strict=False)
         
@@ -94,7 +108,13 @@ def load_shufflenet_model(checkpoint_path, num_classes=26):
         # Move model to device and set to evaluation mode
         model = model.to(device)
         model.eval()
-        
+
+        if device.type == 'cuda':
+            # FP16 halves memory bandwidth and roughly doubles tensor-core
+            # throughput; torch.compile fuses pointwise ops into the convs
+            model = model.half()
+            model = torch.compile(model, mode='reduce-overhead')
+
         return model, device
         
     except Exception as e:
@@ -104,6 +124,186 @@ def load_shufflenet_model(checkpoint_path, num_classes=26):
         return None, device
 
 
+def convert_checkpoint_to_safetensors(checkpoint_path, output_path=None):
+    """
+    One-time conversion of a .pth checkpoint to safetensors format
+
+    Extracts the state dict, strips any DataParallel 'module.' prefixes,
+    and writes an mmap-loadable .safetensors file that
+    load_shufflenet_model loads with near-zero cold-start cost.
+
+    Args:
+        checkpoint_path: Path to the source .pth checkpoint
+        output_path: Destination file (defaults to the same path with
+            a .safetensors extension)
+
+    Returns:
+        Path to the written file or None if conversion fails
+    """
+    try:
+        from safetensors.torch import save_file
+
+        checkpoint = torch.load(checkpoint_path, map_location='cpu', weights_only=True)
+
+        if 'state_dict' in checkpoint:
+            state_dict = checkpoint['state_dict']
+        elif 'model_state_dict' in checkpoint:
+            state_dict = checkpoint['model_state_dict']
+        else:
+            state_dict = checkpoint
+
+        # Strip prefixes once here instead of on every load
+        state_dict = {
+            k.replace("module.", ""): v.contiguous()
+            for k, v in state_dict.items()
+        }
+
+        if output_path is None:
+            output_path = os.path.splitext(str(checkpoint_path))[0] + '.safetensors'
+
+        save_file(state_dict, str(output_path))
+        print(f"Saved safetensors checkpoint to {output_path}")
+        return output_path
+
+    except Exception as e:
+        print(f"Error converting checkpoint: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+
+def export_shufflenet_onnx(model, output_path):
+    """
+    Export the 4-channel ShuffleNet to ONNX for ONNX Runtime inference
+
+    Run once offline (on the CPU FP32 model, before any torch.compile
+    wrapping); load_onnx_session consumes the result. A fused-graph
+    runtime typically beats eager PyTorch 2-4x on CPU for
+    ShuffleNet-class networks.
+
+    Args:
+        model: Loaded ShuffleNet model
+        output_path: Destination .onnx file
+
+    Returns:
+        output_path on success, None on failure
+    """
+    try:
+        model = model.to('cpu').float().eval()
+        dummy_input = torch.zeros(1, 4, 224, 224)
+
+        torch.onnx.export(
+            model,
+            dummy_input,
+            str(output_path),
+            input_names=['input'],
+            output_names=['logits'],
+            dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}},
+            opset_version=17
+        )
+
+        print(f"Exported ONNX model to {output_path}")
+        return output_path
+
+    except Exception as e:
+        print(f"Error exporting ONNX model: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+
+def load_onnx_session(onnx_path):
+    """
+    Create an ONNX Runtime inference session for an exported ShuffleNet
+
+    Args:
+        onnx_path: Path to the .onnx file (see export_shufflenet_onnx)
+
+    Returns:
+        onnxruntime.InferenceSession or None if unavailable
+    """
+    try:
+        import onnxruntime
+    except ImportError:
+        print("onnxruntime not installed; use the PyTorch predict_disease path")
+        return None
+
+    if not os.path.exists(onnx_path):
+        print(f"Error: ONNX model not found at {onnx_path}")
+        return None
+
+    try:
+        session = onnxruntime.InferenceSession(
+            str(onnx_path),
+            providers=['CUDAExecutionProvider', 'CPUExecutionProvider']
+        )
+        print(f"ONNX Runtime session created for {onnx_path}")
+        return session
+
+    except Exception as e:
+        print(f"Error creating ONNX Runtime session: {e}")
+        return None
+
+
+def predict_disease_onnx(input_path, session, class_names):
+    """
+    Predict disease class using an ONNX Runtime session
+
+    Mirrors predict_disease but stays in NumPy end-to-end; expects a
+    .npy file containing a 4-channel (H, W, 4) float array.
+
+    Args:
+        input_path: Path to .npy input file
+        session: ONNX Runtime session from load_onnx_session
+        class_names: List of disease class names
+
+    Returns:
+        Tuple of (predicted_label, confidence)
+    """
+    if session is None:
+        print("Error: Session is None")
+        return None, None
+
+    try:
+        img_array = np.load(input_path).astype(np.float32)
+
+        if img_array.ndim != 3 or img_array.shape[2] != 4:
+            print(f"Error: Expected 4-channel input, got shape {img_array.shape}")
+            return None, None
+
+        if img_array.shape[:2] != (224, 224):
+            img_array = cv2.resize(img_array, (224, 224), interpolation=cv2.INTER_AREA)
+
+        # (H, W, C) -> (1, C, H, W), then the same broadcast normalization
+        # as the PyTorch path
+        x = np.ascontiguousarray(img_array.transpose(2, 0, 1))[np.newaxis, ...]
+        x = (x - _NORM_MEAN.numpy()) / _NORM_STD.numpy()
+
+        logits = session.run(None, {'input': x.astype(np.float32)})[0][0]
+
+        # Softmax over the logits
+        exp = np.exp(logits - logits.max())
+        probabilities = exp / exp.sum()
+
+        predicted_idx = int(np.argmax(probabilities))
+        confidence_val = float(probabilities[predicted_idx])
+
+        if predicted_idx < len(class_names):
+            predicted_label = class_names[predicted_idx]
+        else:
+            predicted_label = f"Class_{predicted_idx}"
+
+        print(f"Prediction: {predicted_label} (confidence: {confidence_val:.2%})")
+
+        return predicted_label, confidence_val
+
+    except Exception as e:
+        print(f"Error during ONNX prediction: {e}")
+        import traceback
+        traceback.print_exc()
+        return None, None
+
+
 def predict_disease(input_path, model, device, class_names):
     """
     Predict disease class from 4-channel input
@@ -145,31 +345,15 @@ def predict_disease(input_path, model, device, class_names):
             
             # Resize to 224x224 if needed
             if img_array.shape[:2] != (224, 224):
-                from PIL import Image
-                # Split channels
-                rgb = img_array[:, :, :3]
-                mask = img_array[:, :, 3]
-                
-                # Resize each component
-                rgb_pil = Image.fromarray((rgb * 255).astype(np.uint8))
-                rgb_resized = np.array(rgb_pil.resize((224, 224))) / 255.0
-                
-                mask_pil = Image.fromarray((mask * 255).astype(np.uint8))
-                mask_resized = np.array(mask_pil.resize((224, 224))) / 255.0
-                
-                # Recombine
-                img_array = np.concatenate([rgb_resized, mask_resized[..., None]], axis=2)
+                # cv2.resize handles the 4-channel float32 array in one
+                # SIMD-vectorized call, with no uint8 round-trip
+                img_array = cv2.resize(img_array, (224, 224), interpolation=cv2.INTER_AREA)
             
             # Convert to tensor: (H, W, C) -> (C, H, W)
-            img_tensor = torch.from_numpy(img_array.transpose(2, 0, 1)).unsqueeze(0)
-            
-            # Normalize (using ImageNet stats for RGB, pass-through for mask)
-            mean = [0.485, 0.456, 0.406, 0.0]
-            std = [0.229, 0.224, 0.225, 1.0]
-            
-            for c in range(4):
-                img_tensor[0, c, :, :] = (img_tensor[0, c, :, :] - mean[c]) / std[c]
-        
+            # Normalization happens after the device move (below) so it can
+            # run on GPU and as one broadcast op instead of a channel loop
+            img_tensor = torch.from_numpy(img_array).permute(2, 0, 1).contiguous().unsqueeze(0)
+
         else:
             # Load as regular RGB image (for testing purposes)
             image = Image.open(input_path).convert('RGB')
@@ -191,9 +375,21 @@ def predict_disease(input_path, model, device, class_names):
         
         # Move to device
         img_tensor = img_tensor.to(device)
-        
-        # Predict
-        with torch.no_grad():
+
+        # Normalize (ImageNet stats for RGB, pass-through for mask);
+        # the RGB-image branch is already normalized by its transform
+        if str(input_path).endswith(".npy"):
+            img_tensor = (img_tensor - _NORM_MEAN.to(device)) / _NORM_STD.to(device)
+
+        if device.type == 'cuda':
+            img_tensor = img_tensor.half()
+
+        # Predict (inference_mode is cheaper than no_grad: it also skips
+        # view tracking; autocast keeps the GPU path in FP16)
+        with torch.inference_mode(), torch.autocast(
+            device_type=device.type, dtype=torch.float16,
+            enabled=device.type == 'cuda'
+        ):
             outputs = model(img_tensor)
             probabilities = torch.nn.functional.softmax(outputs, dim=1)
             confidence, predicted_idx = torch.max(probabilities, 1)
@@ -239,13 +435,7 @@ def get_top_k_predictions(input_path, model, device, class_names, k=3):
         # Load and preprocess input (similar to predict_disease)
         if str(input_path).endswith(".npy"):
             img_array = np.load(input_path).astype(np.float32)
-            img_tensor = torch.from_numpy(img_array.transpose(2, 0, 1)).unsqueeze(0)
-            
-            mean = [0.485, 0.456, 0.406, 0.0]
-            std = [0.229, 0.224, 0.225, 1.0]
-            
-            for c in range(4):
-                img_tensor[0, c, :, :] = (img_tensor[0, c, :, :] - mean[c]) / std[c]
+            img_tensor = torch.from_numpy(img_array).permute(2, 0, 1).contiguous().unsqueeze(0)
         else:
             image = Image.open(input_path).convert('RGB')
             transform = transforms.Compose([
@@ -261,9 +451,19 @@ def get_top_k_predictions(input_path, model, device, class_names, k=3):
             img_tensor = torch.cat([img_tensor, dummy_mask], dim=1)
         
         img_tensor = img_tensor.to(device)
-        
+
+        # Normalize the 4-channel input in one broadcast op
+        if str(input_path).endswith(".npy"):
+            img_tensor = (img_tensor - _NORM_MEAN.to(device)) / _NORM_STD.to(device)
+
+        if device.type == 'cuda':
+            img_tensor = img_tensor.half()
+
         # Get predictions
-        with torch.no_grad():
+        with torch.inference_mode(), torch.autocast(
+            device_type=device.type, dtype=torch.float16,
+            enabled=device.type == 'cuda'
+        ):
             outputs = model(img_tensor)
             probabilities = torch.nn.functional.softmax(outputs, dim=1)[0]
         
@@ -0,0 +1,117 @@
+"""
+Offline conversion of the Keras UNet (.h5) to TFLite for fast CPU inference
+Run once before deployment; load_unet_model prefers the .tflite automatically
+
+Usage:
+    python convert_unet_tflite.py <unet_model.h5> [representative_image_dir]
+
+Without a representative image directory the converter applies dynamic-range
+quantization (weights INT8, activations float). With a directory of ~100
+sample leaf images it performs full INT8 quantization, which halves
+activation memory bandwidth and unlocks XNNPACK's INT8 kernels.
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+
+def representative_dataset_gen(image_dir, input_size=(256, 256), limit=100):
+    """
+    Yield normalized sample images for full INT8 calibration
+
+    Args:
+        image_dir: Directory of representative leaf images
+        input_size: Model input size (width, height)
+        limit: Maximum number of images to use
+
+    Yields:
+        Lists with a single (1, H, W, 3) float32 tensor in [0, 1]
+    """
+    extensions = {'.jpg', '.jpeg', '.png'}
+    paths = [p for p in sorted(Path(image_dir).iterdir())
+             if p.suffix.lower() in extensions][:limit]
+
+    if not paths:
+        raise ValueError(f"No images found in {image_dir}")
+
+    for path in paths:
+        image = cv2.imread(str(path))
+        if image is None:
+            continue
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        image = cv2.resize(image, input_size)
+        image = image.astype(np.float32) / 255.0
+        yield [np.expand_dims(image, axis=0)]
+
+
+def convert_unet_to_tflite(model_path, representative_dir=None):
+    """
+    Convert a Keras UNet .h5 model to a quantized .tflite file
+
+    Args:
+        model_path: Path to the Keras model (.h5)
+        representative_dir: Optional directory of sample images; when given,
+            full INT8 quantization is applied instead of dynamic-range
+
+    Returns:
+        Path to the written .tflite file or None if conversion fails
+    """
+    try:
+        print(f"Loading Keras model from {model_path}...")
+        model = keras.models.load_model(model_path, compile=False)
+
+        converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+        if representative_dir:
+            print(f"Calibrating INT8 quantization on images from {representative_dir}...")
+            converter.representative_dataset = (
+                lambda: representative_dataset_gen(representative_dir)
+            )
+            converter.target_spec.supported_ops = [
+                tf.lite.OpsSet.TFLITE_BUILTINS_INT8
+            ]
+            converter.inference_input_type = tf.int8
+            converter.inference_output_type = tf.int8
+
+        print("Converting to TFLite...")
+        tflite_model = converter.convert()
+
+        output_path = str(model_path)[:-3] + '.tflite' \
+            if str(model_path).endswith('.h5') else str(model_path) + '.tflite'
+        with open(output_path, 'wb') as f:
+            f.write(tflite_model)
+
+        original_mb = os.path.getsize(model_path) / (1024 * 1024)
+        converted_mb = os.path.getsize(output_path) / (1024 * 1024)
+        print(f"Saved TFLite model to {output_path}")
+        print(f"Size: {original_mb:.1f} MB -> {converted_mb:.1f} MB")
+
+        return output_path
+
+    except Exception as e:
+        print(f"Error converting model: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python convert_unet_tflite.py <unet_model.h5> [representative_image_dir]")
+        sys.exit(1)
+
+    model_path = sys.argv[1]
+    representative_dir = sys.argv[2] if len(sys.argv) > 2 else None
+
+    result = convert_unet_to_tflite(model_path, representative_dir)
+
+    if result is None:
+        print("Conversion failed!")
+        sys.exit(1)
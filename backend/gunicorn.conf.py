@@ -7,11 +7,22 @@ bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
 # Worker configuration
 # For ML models, use fewer workers to reduce memory usage
 # TensorFlow/PyTorch models can be memory-intensive
+# gthread lets decode/encode of one request overlap another request's
+# TF inference (TF releases the GIL in its C kernels), and concurrent
+# threads feed the segmentation micro-batcher
 workers = 1
-worker_class = "sync"
+worker_class = "gthread"
+threads = 4
 worker_connections = 1000
 timeout = 120  # Longer timeout for ML inference
 
+# Cap native thread pools before workers import cv2/TF; without this the
+# pools size themselves to the host's core count and thrash small containers
+def on_starting(server):
+    os.environ.setdefault("OMP_NUM_THREADS", "2")
+    os.environ.setdefault("TF_NUM_INTRAOP_THREADS", "2")
+    os.environ.setdefault("TF_NUM_INTEROP_THREADS", "1")
+
 # Logging
 accesslog = "-"
 errorlog = "-"
@@ -3,167 +3,222 @@ Image preprocessing module for Plantalyze
 Implements white balance, CLAHE, denoising, and sharpening
 """
 
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
 import cv2
 import numpy as np
-from pathlib import Path
 
+# Probe the xphoto white-balance capability once at import (it requires
+# opencv-contrib-python); the hot path then takes a plain branch instead
+# of re-running hasattr checks and constructing a new balancer per call
+try:
+    _WB = cv2.xphoto.createSimpleWB() if hasattr(cv2, 'xphoto') else None
+except Exception:
+    _WB = None
+
+# Per-thread scratch buffers handed to OpenCV dst= arguments, keyed by a
+# slot name plus (shape, dtype). preprocess_batch runs on a thread pool,
+# so the buffers are thread-local; repeated same-size frames then reuse
+# the same intermediates instead of allocating fresh ones every call.
+# Scratch arrays are only ever intermediates - anything returned to the
+# caller is freshly allocated
+_SCRATCH = threading.local()
+
+
+def _scratch(slot, shape, dtype=np.uint8):
+    buffers = getattr(_SCRATCH, 'buffers', None)
+    if buffers is None:
+        buffers = _SCRATCH.buffers = {}
+    key = (slot, shape, np.dtype(dtype).str)
+    buf = buffers.get(key)
+    if buf is None:
+        buf = buffers[key] = np.empty(shape, dtype)
+    return buf
 
-def preprocess_leaf(image_path, output_dir=None):
+
+def _get_clahe():
+    # CLAHE objects are reused across calls (apply() keeps internal
+    # histogram buffers warm) but also mutate those buffers, so each
+    # thread gets its own instance - preprocess_batch and the threaded
+    # server run apply_clahe concurrently
+    clahe = getattr(_SCRATCH, 'clahe', None)
+    if clahe is None:
+        clahe = _SCRATCH.clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+    return clahe
+
+
+def preprocess_leaf(image_path, output_dir=None, inference_size=(256, 256)):
     """
     Preprocess leaf image with:
     1. White balance correction
     2. CLAHE (Contrast Limited Adaptive Histogram Equalization)
     3. Denoising
     4. Sharpening
-    
+
     Args:
         image_path: Path to input image
         output_dir: Optional directory to save processed image
-    
+        inference_size: (width, height) the downstream model consumes;
+            see preprocess_leaf_array. Pass None for full resolution.
+
     Returns:
-        Preprocessed image as numpy array (RGB format)
+        Preprocessed image as numpy array (BGR format)
     """
     # Read image
     img = cv2.imread(str(image_path))
     if img is None:
         print(f"Error: Could not read image at {image_path}")
         return None
-    
-    # Convert BGR to RGB
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    
-    # Step 1: White Balance Correction
-    img_wb = apply_white_balance(img)
-    
-    # Step 2: CLAHE on L channel
-    img_clahe = apply_clahe(img_wb)
-    
-    # Step 3: Denoise
-    img_denoised = cv2.fastNlMeansDenoisingColored(
-        img_clahe, 
-        None, 
-        h=10,           # Filter strength for luminance
-        hColor=10,      # Filter strength for color
-        templateWindowSize=7,
-        searchWindowSize=21
-    )
-    
-    # Step 4: Sharpen
-    img_sharp = apply_sharpening(img_denoised)
-    
+
+    img_sharp = preprocess_leaf_array(img, inference_size=inference_size)
+
     # Save if output directory specified
     if output_dir:
         output_path = Path(output_dir)
         output_path.mkdir(parents=True, exist_ok=True)
         stem = Path(image_path).stem
         out_file = output_path / f"{stem}_preprocessed.png"
-        cv2.imwrite(str(out_file), cv2.cvtColor(img_sharp, cv2.COLOR_RGB2BGR))
+        # Compression level 1 encodes several times faster than the
+        # default level 3+ for a debug artifact nobody re-downloads
+        cv2.imwrite(str(out_file), img_sharp, [cv2.IMWRITE_PNG_COMPRESSION, 1])
         print(f"Saved preprocessed image to {out_file}")
-    
+
     return img_sharp
 
 
+def preprocess_leaf_array(img_bgr, inference_size=(256, 256)):
+    """
+    Preprocess an already-decoded leaf image, skipping disk I/O entirely
+
+    The whole pipeline stays in BGR: every stage is colorspace-agnostic
+    (CLAHE works on YCrCb luminance either way), so converting to RGB
+    here and back for cv2 would just add two full-image passes. Callers
+    that need RGB convert once at their own boundary.
+
+    Args:
+        img_bgr: Decoded image as numpy array (BGR format, as from cv2)
+        inference_size: (width, height) the downstream model consumes.
+            Larger images are downscaled to this before filtering, so the
+            bilateral filter and sharpening touch ~65k pixels instead of
+            a multi-megapixel camera frame whose detail the model resize
+            would discard anyway. Pass None to preprocess at full
+            resolution.
+
+    Returns:
+        Preprocessed image as numpy array (BGR format)
+    """
+    # Resize first: everything after this point scales with pixel count
+    if inference_size is not None:
+        target_w, target_h = inference_size
+        h, w = img_bgr.shape[:2]
+        if w > target_w or h > target_h:
+            img_bgr = cv2.resize(img_bgr, (target_w, target_h),
+                                 interpolation=cv2.INTER_AREA)
+
+    # Step 1: White Balance Correction
+    img_wb = apply_white_balance(img_bgr)
+
+    # Step 2: CLAHE on L channel
+    img_clahe = apply_clahe(img_wb)
+
+    # Step 3: Denoise
+    # Bilateral filtering is 10-50x faster than NL-means (which compares
+    # 7x7 patches across a 21x21 window per pixel) while preserving the
+    # leaf edges the segmentation model cares about
+    img_denoised = cv2.bilateralFilter(img_clahe, d=7, sigmaColor=35, sigmaSpace=7)
+
+    # Step 4: Sharpen
+    return apply_sharpening(img_denoised)
+
+
 def apply_white_balance(img):
     """
     Apply white balance correction to image
     Uses opencv xphoto module if available, otherwise falls back to simple gray-world algorithm
-    
+
     Args:
-        img: RGB image as numpy array
-    
+        img: BGR image as numpy array
+
     Returns:
-        White-balanced RGB image
+        White-balanced BGR image
     """
-    try:
-        # Try using OpenCV's xphoto module (requires opencv-contrib-python)
-        if hasattr(cv2, 'xphoto') and hasattr(cv2.xphoto, 'createSimpleWB'):
-            wb = cv2.xphoto.createSimpleWB()
-            img_wb = wb.balanceWhite(img)
-        else:
-            raise AttributeError("xphoto not available")
-    except (AttributeError, cv2.error):
-        # Fallback: Simple gray-world white balance algorithm
-        img_wb = gray_world_white_balance(img)
-    
-    return img_wb
+    if _WB is not None:
+        return _WB.balanceWhite(img)
+
+    # Fallback: Simple gray-world white balance algorithm
+    return gray_world_white_balance(img)
 
 
 def gray_world_white_balance(img):
     """
     Simple gray-world white balance algorithm
     Assumes average color of scene should be gray
-    
+
     Args:
-        img: RGB image as numpy array
-    
+        img: BGR image as numpy array
+
     Returns:
-        White-balanced RGB image
+        White-balanced BGR image
     """
-    img_float = img.astype(np.float32)
-    
-    # Calculate global mean
-    mean_global = np.mean(img)
-    
-    # Balance each channel
-    for i in range(3):
-        mean_channel = np.mean(img[:, :, i])
-        if mean_channel > 0:  # Avoid division by zero
-            img_float[:, :, i] = img_float[:, :, i] * (mean_global / mean_channel)
-    
-    # Clip values to valid range
-    img_wb = np.clip(img_float, 0, 255).astype(np.uint8)
-    
-    return img_wb
+    # One reduction pass gives all three channel means; the global mean is
+    # their average, so no separate full-image reduction is needed
+    means = img.reshape(-1, 3).mean(axis=0)
+    scale_b, scale_g, scale_r = means.mean() / np.maximum(means, 1e-6)
+
+    # cv2.multiply with a per-channel scalar fuses the scale and the
+    # saturating cast back to uint8; the NumPy equivalent materialized
+    # two full-size float32 temporaries for the multiply and the clip
+    return cv2.multiply(img, (scale_b, scale_g, scale_r, 0.0), dtype=cv2.CV_8U)
 
 
 def apply_clahe(img):
     """
     Apply CLAHE (Contrast Limited Adaptive Histogram Equalization)
     Enhances local contrast while avoiding over-amplification
-    
+
     Args:
-        img: RGB image as numpy array
-    
+        img: BGR image as numpy array
+
     Returns:
-        CLAHE-enhanced RGB image
+        CLAHE-enhanced BGR image. The array references a per-thread
+        scratch buffer that is reused on this thread's next call, so
+        copy it if it needs to outlive the current pipeline stage
     """
-    # Convert to LAB color space
-    lab = cv2.cvtColor(img, cv2.COLOR_RGB2LAB)
-    
-    # Split LAB channels
-    l, a, b = cv2.split(lab)
-    
-    # Apply CLAHE to L channel
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    l_clahe = clahe.apply(l)
-    
-    # Merge channels back
-    lab_clahe = cv2.merge((l_clahe, a, b))
-    
-    # Convert back to RGB
-    img_clahe = cv2.cvtColor(lab_clahe, cv2.COLOR_LAB2RGB)
-    
-    return img_clahe
+    # CLAHE only needs a luminance channel; YCrCb gives one at a fraction
+    # of the cost of the BGR<->LAB round-trip (the most expensive cvtColor
+    # mode in OpenCV). Both conversions write into per-thread scratch so
+    # same-size frames reuse the intermediates
+    ycrcb = cv2.cvtColor(img, cv2.COLOR_BGR2YCrCb, dst=_scratch('ycrcb', img.shape))
+
+    # Apply CLAHE to the Y channel in place, avoiding split/merge copies
+    ycrcb[:, :, 0] = _get_clahe().apply(ycrcb[:, :, 0])
+
+    # Convert back to BGR
+    return cv2.cvtColor(ycrcb, cv2.COLOR_YCrCb2BGR, dst=_scratch('clahe_bgr', img.shape))
 
 
 def apply_sharpening(img):
     """
     Apply unsharp masking for image sharpening
-    
+
     Args:
-        img: RGB image as numpy array
-    
+        img: BGR image as numpy array; overwritten with the result
+
     Returns:
-        Sharpened RGB image
+        Sharpened BGR image (the input array, modified in place)
     """
-    # Create Gaussian blur
-    blur = cv2.GaussianBlur(img, (0, 0), sigmaX=1, sigmaY=1)
-    
-    # Unsharp mask: original + (original - blur) * amount
-    # Using addWeighted: img * 1.5 + blur * (-0.5)
-    img_sharp = cv2.addWeighted(img, 1.5, blur, -0.5, 0)
-    
-    return img_sharp
+    # Create Gaussian blur in a per-thread scratch buffer; it is only an
+    # intermediate for the unsharp mask
+    blur = cv2.GaussianBlur(img, (0, 0), sigmaX=1, sigmaY=1,
+                            dst=_scratch('blur', img.shape))
+
+    # Unsharp mask: original + (original - blur) * amount, written back
+    # over the input - addWeighted reads both sources before storing, so
+    # dst=img is safe and saves the output allocation
+    return cv2.addWeighted(img, 1.5, blur, -0.5, 0, dst=img)
 
 
 def preprocess_batch(image_paths, output_dir=None):
@@ -177,15 +232,18 @@ def preprocess_batch(image_paths, output_dir=None):
     Returns:
         List of preprocessed images
     """
-    results = []
-    
-    for img_path in image_paths:
-        preprocessed = preprocess_leaf(img_path, output_dir)
-        if preprocessed is not None:
-            results.append(preprocessed)
-        else:
-            print(f"Warning: Failed to preprocess {img_path}")
-    
+    # OpenCV drops the GIL inside its C routines, so plain threads give
+    # near-linear scaling across images
+    with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as executor:
+        processed = executor.map(lambda p: preprocess_leaf(p, output_dir), image_paths)
+
+        results = []
+        for img_path, preprocessed in zip(image_paths, processed):
+            if preprocessed is not None:
+                results.append(preprocessed)
+            else:
+                print(f"Warning: Failed to preprocess {img_path}")
+
     return results
 
 
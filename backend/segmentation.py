@@ -5,41 +5,184 @@ Loads UNet model and generates segmentation masks for leaf disease detection
 
 import cv2
 import numpy as np
-from tensorflow import keras
-import tensorflow as tf
 import os
 
-# Suppress TensorFlow warnings
+# Suppress TensorFlow warnings (set before the lazy import below runs)
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 os.environ['TF_ENABLE_ONEDNN_OPTS'] = '0'
 
+# TensorFlow is imported lazily: it adds seconds of import time and
+# hundreds of MB of RSS, and the mask utilities in this module (LUT
+# remapping, colored masks, overlays) do not need it at all. The first
+# model load pulls it in.
+tf = None
+keras = None
+
+
+def _ensure_tf():
+    global tf, keras
+    if tf is None:
+        import tensorflow
+        tf = tensorflow
+        keras = tensorflow.keras
+
+# Verbose per-prediction logging; each debug line costs a full-array pass,
+# so it is off unless explicitly enabled
+DEBUG = os.environ.get('PLANTALYZE_DEBUG', '').lower() in ('1', 'true', 'yes')
+
+# Maps UNet class indices to mask gray values: class 0 -> 0 (background),
+# class 1 -> 128 (healthy), class 2 -> 255 (diseased); any other index
+# falls through to 255
+_CLASS_LUT = np.full(256, 255, dtype=np.uint8)
+_CLASS_LUT[0] = 0
+_CLASS_LUT[1] = 128
+_CLASS_LUT[2] = 255
+
+# RGB palette for mask visualization, indexed by mask gray value:
+# background stays black, healthy tissue is green, disease is red
+_PALETTE = np.zeros((256, 3), dtype=np.uint8)
+_PALETTE[128] = [0, 255, 0]
+_PALETTE[255] = [255, 0, 0]
+
+
+# Optional fused argmax+remap kernel for the multi-class branch. Numba is
+# not a hard dependency; when it is installed the kernel collapses the
+# argmax, the uint8 cast and the LUT gather into one parallel pass with no
+# intermediate index array. Without it the NumPy path below is used.
+try:
+    from numba import njit, prange
+
+    @njit(parallel=True, cache=True, fastmath=True)
+    def _argmax_remap(pred, lut, out):
+        h, w, c = pred.shape
+        for i in prange(h):
+            for j in range(w):
+                best = 0
+                best_val = pred[i, j, 0]
+                for k in range(1, c):
+                    if pred[i, j, k] > best_val:
+                        best_val = pred[i, j, k]
+                        best = k
+                out[i, j] = lut[best]
+except ImportError:
+    _argmax_remap = None
+
+
+# Compiled inference functions cached per loaded Keras model. Calling the
+# model directly inside a tf.function skips model.predict's per-call
+# dataset machinery - a 2-5x win for single-image inference - and keeps
+# the cast/normalize steps on the device
+_INFER_FNS = {}
+
+
+def _get_infer_fn(model):
+    fn = _INFER_FNS.get(id(model))
+    if fn is None:
+        @tf.function(reduce_retracing=True)
+        def fn(image_u8):
+            x = tf.cast(image_u8, tf.float32) / 255.0
+            return model(x[tf.newaxis, ...], training=False)[0]
+
+        _INFER_FNS[id(model)] = fn
+    return fn
+
+
+class TFLiteUNet:
+    """
+    Thin wrapper around a TFLite interpreter exposing a Keras-style predict()
+
+    Quantized (INT8) models are handled transparently: float inputs are
+    quantized on the way in and outputs dequantized on the way out, so
+    callers see the same float interface as the Keras model.
+    """
+
+    def __init__(self, model_path, num_threads=None):
+        _ensure_tf()
+        # Honor the container's OMP_NUM_THREADS cap when set (the servers
+        # set it for small instances); otherwise use every core. XNNPACK
+        # threads beyond the vCPU count only add scheduling overhead.
+        if num_threads is None:
+            num_threads = int(os.environ.get('OMP_NUM_THREADS', 0)) or os.cpu_count()
+        self.interpreter = tf.lite.Interpreter(
+            model_path=str(model_path),
+            num_threads=num_threads
+        )
+        self.interpreter.allocate_tensors()
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_detail = self.interpreter.get_output_details()[0]
+
+    def predict(self, batch, verbose=0):
+        # The interpreter input tensor is fixed at batch size 1, so larger
+        # batches (e.g. from the micro-batcher) are run image by image
+        outputs = [self._predict_one(image[np.newaxis, ...]) for image in batch]
+        return np.concatenate(outputs, axis=0)
+
+    def _predict_one(self, data):
+        data = data.astype(np.float32)
+
+        # Quantize input if the model expects INT8
+        if self.input_detail['dtype'] == np.int8:
+            scale, zero_point = self.input_detail['quantization']
+            data = np.round(data / scale + zero_point).astype(np.int8)
+
+        self.interpreter.set_tensor(self.input_detail['index'], data)
+        self.interpreter.invoke()
+        output = self.interpreter.get_tensor(self.output_detail['index'])
+
+        # Dequantize output back to float probabilities
+        if self.output_detail['dtype'] == np.int8:
+            scale, zero_point = self.output_detail['quantization']
+            output = (output.astype(np.float32) - zero_point) * scale
+
+        return output
+
 
 def load_unet_model(model_path):
     """
-    Load UNet model from .h5 file
-    
+    Load UNet model from .tflite or .h5 file
+
+    A sibling .tflite file is preferred over the .h5 when present:
+    TFLite with XNNPACK is several times faster than FP32 Keras
+    inference on CPU (see convert_unet_tflite.py for the conversion).
+
     Args:
-        model_path: Path to UNet model file (.h5)
-    
+        model_path: Path to UNet model file (.tflite or .h5)
+
     Returns:
-        Loaded Keras model or None if loading fails
+        Loaded model (TFLiteUNet or Keras model) or None if loading fails
     """
     try:
+        _ensure_tf()
+        model_path = str(model_path)
+
+        # Prefer a converted .tflite next to the .h5 if one exists
+        if model_path.endswith('.h5'):
+            tflite_path = model_path[:-3] + '.tflite'
+            if os.path.exists(tflite_path):
+                model_path = tflite_path
+
         print(f"Loading UNet model from {model_path}...")
-        
+
         if not os.path.exists(model_path):
             print(f"Error: Model file not found at {model_path}")
             return None
-        
+
+        if model_path.endswith('.tflite'):
+            model = TFLiteUNet(model_path)
+            print(f"UNet TFLite model loaded successfully!")
+            print(f"Input shape: {model.input_detail['shape']}")
+            print(f"Output shape: {model.output_detail['shape']}")
+            return model
+
         # Load model without compiling (we only need inference)
         model = keras.models.load_model(model_path, compile=False)
-        
+
         print(f"UNet model loaded successfully!")
         print(f"Input shape: {model.input_shape}")
         print(f"Output shape: {model.output_shape}")
-        
+
         return model
-        
+
     except Exception as e:
         print(f"Error loading UNet model: {e}")
         import traceback
@@ -69,42 +212,108 @@ def predict_segmentation(image_path, model):
         return None
     
     try:
-        # Read image
-        image = cv2.imread(str(image_path))
+        # PIL.Image.open is lazy - it parses only the header - so probing
+        # the true dimensions costs a few KB of I/O, not a full decode
+        try:
+            from PIL import Image
+            with Image.open(image_path) as probe:
+                original_size = probe.size  # (width, height)
+                # cv2.imread applies EXIF rotation but probe.size reports
+                # the stored dimensions; transpose for the orientations
+                # that swap width and height (typical phone photos) so the
+                # final mask resize matches the decoded image
+                if probe.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+                    original_size = (original_size[1], original_size[0])
+        except Exception:
+            original_size = None
+
+        # Large files are decoded at reduced resolution: for JPEG the
+        # decoder skips DCT coefficients outright, so IMREAD_REDUCED_COLOR_N
+        # is far cheaper than decoding full-size and resizing, and the
+        # model input is only 256x256 anyway
+        flag = cv2.IMREAD_COLOR
+        if original_size is not None:
+            if min(original_size) >= 1024:
+                flag = cv2.IMREAD_REDUCED_COLOR_4
+            elif min(original_size) >= 512:
+                flag = cv2.IMREAD_REDUCED_COLOR_2
+
+        # Read image (BGR, as predict_segmentation_array expects)
+        image = cv2.imread(str(image_path), flag)
         if image is None:
             print(f"Error: Could not read image at {image_path}")
             return None
-        
+
+        mask = predict_segmentation_array(image, model)
+
+        # The array call sizes the mask to its (possibly reduced) input;
+        # scale it back up to the file's true dimensions
+        if mask is not None and original_size is not None \
+                and mask.shape[:2] != (original_size[1], original_size[0]):
+            mask = cv2.resize(mask, original_size, interpolation=cv2.INTER_NEAREST)
+
+        return mask
+
+    except Exception as e:
+        print(f"Error during segmentation prediction: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+
+def predict_segmentation_array(image_bgr, model):
+    """
+    Generate segmentation mask from an already-decoded image, skipping disk I/O
+
+    Args:
+        image_bgr: Decoded image as numpy array (BGR format, as from cv2)
+        model: Loaded UNet model
+
+    Returns:
+        Segmentation mask as numpy array (H, W) with values 0, 128, 255
+        Returns None if prediction fails
+    """
+    if model is None:
+        print("Error: Model is None")
+        return None
+
+    try:
         # Store original size for resizing mask back
-        original_size = (image.shape[1], image.shape[0])  # (width, height)
-        
-        # Resize to model input size (typically 256x256)
-        image_resized = cv2.resize(image, (256, 256))
-        
-        # Convert BGR to RGB
-        image_rgb = cv2.cvtColor(image_resized, cv2.COLOR_BGR2RGB)
-        
-        # Normalize to [0, 1]
-        image_normalized = image_rgb.astype(np.float32) / 255.0
-        
-        # Add batch dimension
-        image_input = np.expand_dims(image_normalized, axis=0)
-        
-        # Predict
-        prediction = model.predict(image_input, verbose=0)[0]
-        
+        original_size = (image_bgr.shape[1], image_bgr.shape[0])  # (width, height)
+
+        # Resize to model input size (typically 256x256) unless the caller
+        # already preprocessed at that size, then do the one required
+        # BGR->RGB conversion on the small image instead of at full
+        # resolution
+        if image_bgr.shape[:2] != (256, 256):
+            image_resized = cv2.resize(image_bgr, (256, 256))
+        else:
+            image_resized = image_bgr
+        image_resized = cv2.cvtColor(image_resized, cv2.COLOR_BGR2RGB)
+
+        # Predict. Plain Keras models go through the compiled tf.function,
+        # which normalizes on-device and avoids model.predict overhead;
+        # wrappers like TFLiteUNet or the micro-batcher keep their own
+        # predict() contract
+        if keras is not None and isinstance(model, keras.Model):
+            prediction = _get_infer_fn(model)(tf.convert_to_tensor(image_resized)).numpy()
+        else:
+            # Normalize to [0, 1] and add batch dimension
+            image_input = np.expand_dims(image_resized.astype(np.float32) / 255.0, axis=0)
+            prediction = model.predict(image_input, verbose=0)[0]
+
         # Process prediction based on output format
         mask = process_unet_output(prediction)
-        
+
         # Resize mask back to original image size
         mask_resized = cv2.resize(
-            mask, 
-            original_size, 
+            mask,
+            original_size,
             interpolation=cv2.INTER_NEAREST
         )
-        
+
         return mask_resized
-        
+
     except Exception as e:
         print(f"Error during segmentation prediction: {e}")
         import traceback
@@ -127,26 +336,34 @@ def process_unet_output(prediction):
     Returns:
         Segmentation mask (H, W) with values 0, 128, 255
     """
-    print(f"UNet prediction shape: {prediction.shape}, dtype: {prediction.dtype}")
-    print(f"UNet prediction range: [{prediction.min():.3f}, {prediction.max():.3f}]")
-    
+    if DEBUG:
+        print(f"UNet prediction shape: {prediction.shape}, dtype: {prediction.dtype}")
+        print(f"UNet prediction range: [{prediction.min():.3f}, {prediction.max():.3f}]")
+
     # Case 1: Multi-class output (e.g., shape (256, 256, 3))
     if prediction.ndim == 3 and prediction.shape[-1] >= 3:
-        print(f"Processing as multi-class output with {prediction.shape[-1]} classes")
+        # The fused kernel writes the final gray values directly; the
+        # DEBUG path still needs the intermediate class indices, so it
+        # falls through to the NumPy version
+        if _argmax_remap is not None and not DEBUG:
+            mask = np.empty(prediction.shape[:2], dtype=np.uint8)
+            _argmax_remap(np.ascontiguousarray(prediction), _CLASS_LUT, mask)
+            return mask
+
         # Get class with highest probability
         mask_idx = np.argmax(prediction, axis=-1).astype(np.uint8)
-        
-        print(f"Class indices - unique values: {np.unique(mask_idx)}")
-        print(f"Class 0 (background): {np.sum(mask_idx == 0)} pixels")
-        print(f"Class 1 (healthy): {np.sum(mask_idx == 1)} pixels")
-        print(f"Class 2 (diseased): {np.sum(mask_idx == 2)} pixels")
-        
-        # Map class indices to mask values
-        # Class 0 -> 0 (background)
-        # Class 1 -> 128 (healthy leaf)
-        # Class 2 -> 255 (diseased)
-        mapping = {0: 0, 1: 128, 2: 255}
-        mask = np.vectorize(lambda x: mapping.get(x, 255))(mask_idx).astype(np.uint8)
+
+        if DEBUG:
+            print(f"Processing as multi-class output with {prediction.shape[-1]} classes")
+            print(f"Class indices - unique values: {np.unique(mask_idx)}")
+            print(f"Class 0 (background): {np.sum(mask_idx == 0)} pixels")
+            print(f"Class 1 (healthy): {np.sum(mask_idx == 1)} pixels")
+            print(f"Class 2 (diseased): {np.sum(mask_idx == 2)} pixels")
+
+        # Map class indices to mask values with a single LUT gather;
+        # a np.vectorize dict lookup here would call back into Python
+        # once per pixel
+        mask = _CLASS_LUT[mask_idx]
     
     # Case 2: Binary classification (e.g., shape (256, 256, 2))
     elif prediction.ndim == 3 and prediction.shape[-1] == 2:
@@ -160,15 +377,12 @@ def process_unet_output(prediction):
         if prediction.ndim == 3:
             prediction = prediction.squeeze()
         
-        # Threshold continuous values
-        mask = (prediction * 255).astype(np.uint8)
-        
-        # Create 3-class mask based on thresholds
-        mask_3class = np.zeros_like(mask)
-        mask_3class[mask < 85] = 0       # Background
-        mask_3class[(mask >= 85) & (mask < 170)] = 128  # Healthy leaf
-        mask_3class[mask >= 170] = 255   # Diseased
-        mask = mask_3class
+        # Bucket the continuous values straight into class indices
+        # (< 85/255 background, < 170/255 healthy, else diseased), then map
+        # indices to gray values with the shared LUT. One digitize pass plus
+        # one gather replaces the uint8 round-trip and three boolean masks
+        mask_idx = np.digitize(prediction, [85 / 255.0, 170 / 255.0]).astype(np.uint8)
+        mask = _CLASS_LUT[mask_idx]
     
     return mask
 
@@ -183,19 +397,8 @@ def create_colored_mask(mask):
     Returns:
         RGB colored mask (black/green/red)
     """
-    h, w = mask.shape
-    colored_mask = np.zeros((h, w, 3), dtype=np.uint8)
-    
-    # Black for background
-    colored_mask[mask == 0] = [0, 0, 0]
-    
-    # Green for healthy leaf tissue
-    colored_mask[mask == 128] = [0, 255, 0]
-    
-    # Red for diseased regions
-    colored_mask[mask == 255] = [255, 0, 0]
-    
-    return colored_mask
+    # Single palette gather: one pass over the mask, no boolean temporaries
+    return _PALETTE[mask]
 
 
 def create_overlay(image, mask, alpha=0.4):
@@ -243,17 +446,14 @@ def extract_diseased_regions(image, mask):
     Returns:
         Image with only diseased regions visible (rest is black)
     """
-    result = image.copy()
-    
     # Ensure same size
     if image.shape[:2] != mask.shape:
-        mask = cv2.resize(mask, (image.shape[1], image.shape[0]), 
+        mask = cv2.resize(mask, (image.shape[1], image.shape[0]),
                          interpolation=cv2.INTER_NEAREST)
-    
-    # Set non-diseased pixels to black
-    result[mask != 255] = [0, 0, 0]
-    
-    return result
+
+    # Single np.where pass: keeps diseased pixels, zeros the rest, and
+    # writes the output directly instead of copying the full image first
+    return np.where((mask == 255)[:, :, None], image, np.uint8(0))
 
 
 if __name__ == "__main__":
@@ -19,8 +19,33 @@ if sys.version_info < (3, 8):
 else:
     print(f"   ✓ Python {sys.version_info.major}.{sys.version_info.minor}.{sys.version_info.micro}")
 
+# Check model files first - a couple of stat calls. Doing this before the
+# package probes means a missing model fails in milliseconds instead of
+# after TensorFlow and PyTorch have spent seconds importing.
+print("\n2. Checking model files...")
+backend_dir = Path(__file__).parent
+
+unet_path = backend_dir / "unet_model.h5"
+shufflenet_path = backend_dir / "Best_ShuffleNet_Model.pth"
+
+if unet_path.exists():
+    size_mb = unet_path.stat().st_size / (1024 * 1024)
+    print(f"   ✓ UNet model found ({size_mb:.1f} MB)")
+else:
+    print(f"   ❌ UNet model NOT FOUND at {unet_path}")
+
+if shufflenet_path.exists():
+    size_mb = shufflenet_path.stat().st_size / (1024 * 1024)
+    print(f"   ✓ ShuffleNet model found ({size_mb:.1f} MB)")
+else:
+    print(f"   ❌ ShuffleNet model NOT FOUND at {shufflenet_path}")
+
+if not (unet_path.exists() and shufflenet_path.exists()):
+    print("\n   Please ensure model files are in the backend directory")
+    sys.exit(1)
+
 # Check required packages
-print("\n2. Checking required packages...")
+print("\n3. Checking required packages...")
 required_packages = [
     ('flask', 'Flask'),
     ('flask_cors', 'Flask-CORS'),
@@ -45,29 +70,6 @@ if missing_packages:
     print("   Run: pip install -r requirements.txt")
     sys.exit(1)
 
-# Check model files
-print("\n3. Checking model files...")
-backend_dir = Path(__file__).parent
-
-unet_path = backend_dir / "unet_model.h5"
-shufflenet_path = backend_dir / "Best_ShuffleNet_Model.pth"
-
-if unet_path.exists():
-    size_mb = unet_path.stat().st_size / (1024 * 1024)
-    print(f"   ✓ UNet model found ({size_mb:.1f} MB)")
-else:
-    print(f"   ❌ UNet model NOT FOUND at {unet_path}")
-
-if shufflenet_path.exists():
-    size_mb = shufflenet_path.stat().st_size / (1024 * 1024)
-    print(f"   ✓ ShuffleNet model found ({size_mb:.1f} MB)")
-else:
-    print(f"   ❌ ShuffleNet model NOT FOUND at {shufflenet_path}")
-
-if not (unet_path.exists() and shufflenet_path.exists()):
-    print("\n   Please ensure model files are in the backend directory")
-    sys.exit(1)
-
 # Test model loading
 print("\n4. Testing model loading...")
 
@@ -129,7 +129,14 @@ const Dashboard = () => {
       }
 
       const data = await response.json();
-      
+
+      // The persistent backend serves the mask as a raw PNG URL instead
+      // of inline base64 (the serverless API inlines it); resolve the URL
+      // against the backend origin for the <img> tag
+      if (data.maskUrl && !data.segmentationMask) {
+        data.segmentationMask = `${BACKEND_URL}${data.maskUrl}`;
+      }
+
       setResult(data);
       if (!data.isLeaf) {
         toast.error("No leaf detected in the image. Please upload a clear photo of a plant leaf.");